@@ -25,6 +25,7 @@ interface FeedbackResponse {
   feedback_count?: number;
   total_classes?: number;
   classes?: string[];
+  retrain_status?: string | null;
 }
 
 // ML Service Client
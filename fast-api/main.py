@@ -1,28 +1,82 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import pandas as pd
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import train_test_split, GridSearchCV, HalvingGridSearchCV
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 from sklearn.naive_bayes import ComplementNB
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import classification_report
-import pickle
+import joblib
+import asyncio
+import csv
 import os
+import shutil
+import tempfile
+import threading
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 
-app_nb = FastAPI(title="Naive Bayes Text Classification API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the /predict batcher; the model itself is loaded on first use"""
+    global _predict_queue, _predict_batcher_task
+    _predict_queue = asyncio.Queue()
+    _predict_batcher_task = asyncio.create_task(_predict_batcher())
+    yield
+    _predict_batcher_task.cancel()
+
+app_nb = FastAPI(title="Naive Bayes Text Classification API", lifespan=lifespan)
 
 MODEL_PATH = "nb_model.pkl"
 FEEDBACK_PATH = "feedback_data.csv"
-RETRAIN_THRESHOLD = 1
+RETRAIN_THRESHOLD = 100
+INCREMENTAL_SAVE_EVERY = 10  # partial_fit updates between saves of MODEL_PATH
+PREDICTION_CACHE_SIZE = 4096
+PREDICT_BATCH_SIZE = 64
+PREDICT_BATCH_WINDOW = 0.005  # seconds to wait for more /predict calls to join a batch
+
+# Full retrains run in a separate process so they never hold the GIL of the server
+_retrain_executor = ProcessPoolExecutor(max_workers=1)
+_retrain_future = None
+_retrain_running = False  # set until the retrained model has been swapped in
+_retrain_status = None  # outcome of the last full retrain, reported by /feedback
+
+class InsufficientTrainingDataError(ValueError):
+    """Raised when there is not enough data yet to train the model"""
 
-def train_nb_model():
+def _build_analyzer(ngram_range):
+    """Build the word analyzer (stop words, token regex, n-grams) a single time"""
+    return HashingVectorizer(stop_words='english', lowercase=True, ngram_range=ngram_range).build_analyzer()
+
+# Built once at import and reused by every fit, CV fold and transform
+_UNIGRAM_ANALYZER = _build_analyzer((1,1))
+_BIGRAM_ANALYZER = _build_analyzer((1,2))
+
+def build_nb_pipeline(memory=None):
+    """Hashing -> TF-IDF -> ComplementNB pipeline that train_nb_model searches over"""
+    return Pipeline([
+        # alternate_sign=False keeps features non-negative, as ComplementNB requires.
+        # norm=None hands raw counts to TfidfTransformer, which does the normalizing;
+        # sublinear_tf on already-normalized values (< 1) would go negative
+        ('hash', HashingVectorizer(analyzer=_BIGRAM_ANALYZER, alternate_sign=False, n_features=2**15, norm=None, dtype=np.float32)),
+        ('tfidf', TfidfTransformer(sublinear_tf=True)),
+        ('nb', ComplementNB())
+    ], memory=memory)
+
+def train_nb_model(feedback_rows=None):
     fname = 'nepal_expenses.csv'
     df = None
     
     # Try to load original dataset
     if os.path.exists(fname):
         try:
-            df = pd.read_csv(fname, parse_dates=['Date'], dayfirst=True, sep=',', on_bad_lines='skip')
+            # Only Note/Category are used for training, so Date is not parsed at all
+            df = pd.read_csv(fname, usecols=['Note', 'Category'], sep=',', on_bad_lines='skip', engine='pyarrow')
             df = df.dropna(subset=['Note', 'Category'])
             print(f"Loaded {len(df)} samples from original dataset")
         except Exception as e:
@@ -33,7 +87,10 @@ def train_nb_model():
     feedback_df = None
     if os.path.exists(FEEDBACK_PATH):
         try:
-            feedback_df = pd.read_csv(FEEDBACK_PATH)
+            feedback_df = pd.read_csv(FEEDBACK_PATH, usecols=['text', 'category'], engine='pyarrow')
+            if feedback_rows is not None:
+                # Rows saved after the caller counted them are replayed onto the new model
+                feedback_df = feedback_df.head(feedback_rows)
             feedback_df = feedback_df.dropna(subset=['text', 'category'])
             feedback_df = feedback_df.rename(columns={'text': 'Note', 'category': 'Category'})
             print(f"Loaded {len(feedback_df)} samples from feedback data")
@@ -50,18 +107,18 @@ def train_nb_model():
     elif df is not None:
         print("Training with original data only")
     else:
-        raise ValueError("No training data available. Need either original dataset or feedback data.")
+        raise InsufficientTrainingDataError("No training data available. Need either original dataset or feedback data.")
     
     # Validate minimum data requirements
     if len(df) < 4:
-        raise ValueError(f"Insufficient training data: {len(df)} samples. Need at least 4 samples.")
+        raise InsufficientTrainingDataError(f"Insufficient training data: {len(df)} samples. Need at least 4 samples.")
     
     counts = df['Category'].value_counts()
     valid = counts[counts >= 2].index
     df = df[df['Category'].isin(valid)]
     
     if len(df) < 4:
-        raise ValueError(f"Insufficient valid categories after filtering: {len(df)} samples remaining.")
+        raise InsufficientTrainingDataError(f"Insufficient valid categories after filtering: {len(df)} samples remaining.")
     
     X = df['Note']
     y = df['Category']
@@ -69,27 +126,59 @@ def train_nb_model():
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
     )
-    pipeline = Pipeline([
-        ('tfidf', TfidfVectorizer(stop_words='english', lowercase=True)),
-        ('nb', ComplementNB())
-    ])
+    # Cache the fitted hash/tfidf steps per fold, so candidates that only differ
+    # in nb__alpha reuse the transformed features instead of re-vectorizing
+    cache_dir = tempfile.mkdtemp(prefix='nb_pipeline_cache_')
+    pipeline = build_nb_pipeline(memory=cache_dir)
     param_grid = {
-        'tfidf__ngram_range': [(1,2), (1,3)],
+        'hash__analyzer': [_UNIGRAM_ANALYZER, _BIGRAM_ANALYZER],
         'nb__alpha': [0.1, 0.5, 1.0]
     }
-    grid = GridSearchCV(pipeline, param_grid, cv=5, n_jobs=-1, scoring='f1_weighted')
-    grid.fit(X_train, y_train)
-    print("Best params:", grid.best_params_)
+    cv = 3
+    # Successive halving drops weak candidates on small subsets before using all
+    # samples, but needs at least 2 * cv * n_classes samples for its first round
+    if len(X_train) >= 2 * cv * y_train.nunique():
+        grid = HalvingGridSearchCV(pipeline, param_grid, factor=3, resource='n_samples', cv=cv, n_jobs=-1, scoring='f1_weighted')
+    else:
+        grid = GridSearchCV(pipeline, param_grid, cv=cv, n_jobs=-1, scoring='f1_weighted')
+    try:
+        grid.fit(X_train, y_train)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    grid.best_estimator_.set_params(memory=None)
+    best_ngrams = '(1,1)' if grid.best_params_['hash__analyzer'] is _UNIGRAM_ANALYZER else '(1,2)'
+    print(f"Best params: ngram_range={best_ngrams}, alpha={grid.best_params_['nb__alpha']}")
     print(classification_report(y_test, grid.best_estimator_.predict(X_test)))
-    with open(MODEL_PATH, 'wb') as f:
-        pickle.dump(grid.best_estimator_, f)
+    save_nb_model(grid.best_estimator_)
     return grid.best_estimator_
 
-if os.path.exists(MODEL_PATH):
-    with open(MODEL_PATH, 'rb') as f:
-        nb_model = pickle.load(f)
-else:
-    nb_model = train_nb_model()
+def save_nb_model(model):
+    """Persist the model to MODEL_PATH"""
+    # Uncompressed so the arrays can be memory-mapped on load. Write to a temp
+    # file and rename, since a live mmap of MODEL_PATH must never be truncated;
+    # the pid keeps the server and the retrain worker off each other's temp file
+    tmp_path = f"{MODEL_PATH}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path, compress=0)
+    os.replace(tmp_path, MODEL_PATH)
+
+def load_nb_model():
+    """Load the persisted model with its numpy arrays memory-mapped"""
+    # Copy-on-write mapping: pages are shared between worker processes until
+    # partial_fit modifies them in place
+    return joblib.load(MODEL_PATH, mmap_mode='c')
+
+# Loaded lazily by get_nb_model so worker processes start without paying for it
+nb_model = None
+_model_lock = threading.Lock()
+
+def get_nb_model():
+    """Return the current model, loading or training it on first use"""
+    global nb_model
+    if nb_model is None:
+        with _model_lock:
+            if nb_model is None:
+                nb_model = load_nb_model() if os.path.exists(MODEL_PATH) else train_nb_model()
+    return nb_model
 
 class TextInput(BaseModel):
     text: str
@@ -99,61 +188,230 @@ class FeedbackInput(BaseModel):
     category: str
 
 
+# LRU cache of text -> (category, confidence); cleared whenever nb_model changes
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()  # retrain swaps clear it from another thread
+_cache_generation = 0
+_predict_queue = None
+_predict_batcher_task = None
+
+def _get_cached_prediction(text: str):
+    with _prediction_cache_lock:
+        result = _prediction_cache.get(text)
+        if result is not None:
+            _prediction_cache.move_to_end(text)
+        return result
+
+def _cache_prediction(text: str, result: tuple[str, float], generation: int):
+    with _prediction_cache_lock:
+        # Skip caching if the model changed while this result was being computed
+        if generation != _cache_generation:
+            return
+        _prediction_cache[text] = result
+        _prediction_cache.move_to_end(text)
+        if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
+
+def clear_prediction_cache():
+    """Drop cached predictions, e.g. after the model was updated or retrained"""
+    global _cache_generation
+    with _prediction_cache_lock:
+        _cache_generation += 1
+        _prediction_cache.clear()
+
+def _predict_batch(texts: list[str]) -> list[tuple[str, float]]:
+    """Predict (category, confidence) for several texts in a single pipeline pass"""
+    model = get_nb_model()
+    nb = model.named_steps['nb']
+    jll = nb.predict_joint_log_proba(model[:-1].transform(texts))
+    predicted_indices = jll.argmax(axis=1)
+    # Only the top class' probability is needed, so skip normalizing the whole row
+    confidences = np.exp(jll[np.arange(len(texts)), predicted_indices] - logsumexp(jll, axis=1))
+    return [(nb.classes_[i], float(c)) for i, c in zip(predicted_indices, confidences)]
+
+async def _predict_batcher():
+    """Collect concurrent /predict requests and score them together"""
+    while True:
+        batch = [await _predict_queue.get()]
+        await asyncio.sleep(PREDICT_BATCH_WINDOW)
+        while len(batch) < PREDICT_BATCH_SIZE and not _predict_queue.empty():
+            batch.append(_predict_queue.get_nowait())
+
+        generation = _cache_generation
+        try:
+            results = await asyncio.to_thread(_predict_batch, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for (text, future), result in zip(batch, results):
+            _cache_prediction(text, result, generation)
+            if not future.done():
+                future.set_result(result)
+
 @app_nb.post("/predict")
 async def predict_category(input: TextInput):
     try:
-        prediction_proba = nb_model.predict_proba([input.text])
-        predicted_category_index = prediction_proba.argmax()
-        predicted_category = nb_model.classes_[predicted_category_index]
-        confidence = prediction_proba[0][predicted_category_index]
+        result = _get_cached_prediction(input.text)
+        if result is None:
+            future = asyncio.get_running_loop().create_future()
+            await _predict_queue.put((input.text, future))
+            result = await future
+        predicted_category, confidence = result
         print(f"Predicted category: {predicted_category}, Confidence: {confidence}")
         if confidence < 0.4:
-            return {"category": "Unknown", "confidence": float(confidence)}
-        return {"category": predicted_category, "confidence": float(confidence)}
+            return {"category": "Unknown", "confidence": confidence}
+        return {"category": predicted_category, "confidence": confidence}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+def _count_feedback_rows():
+    """Count feedback entries by streaming CSV records instead of building a DataFrame"""
+    if not os.path.exists(FEEDBACK_PATH):
+        return 0
+    # Records, not lines: quoted feedback text may contain newlines
+    with open(FEEDBACK_PATH, newline='', encoding='utf-8') as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+_feedback_count = _count_feedback_rows()
+_feedback_lock = threading.Lock()
+_model_update_lock = threading.Lock()  # serializes partial_fit updates and their saves
+_unsaved_updates = 0
+
 def save_feedback(text: str, category: str):
     """Store feedback data to CSV file for incremental learning"""
-    feedback_data = pd.DataFrame([[text, category]], columns=['text', 'category'])
-    if os.path.exists(FEEDBACK_PATH):
-        feedback_data.to_csv(FEEDBACK_PATH, mode='a', header=False, index=False)
-    else:
-        feedback_data.to_csv(FEEDBACK_PATH, index=False)
+    global _feedback_count
+    with _feedback_lock:
+        exists = os.path.exists(FEEDBACK_PATH)
+        with open(FEEDBACK_PATH, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            if not exists:
+                writer.writerow(['text', 'category'])
+            writer.writerow([text, category])
+        _feedback_count += 1
 
 def get_feedback_count():
     """Get current number of feedback entries"""
-    if os.path.exists(FEEDBACK_PATH):
-        return len(pd.read_csv(FEEDBACK_PATH))
-    return 0
+    return _feedback_count
+
+def should_retrain(feedback_count: int):
+    """Check if a full retrain is due, i.e. every RETRAIN_THRESHOLD feedback entries"""
+    return feedback_count % RETRAIN_THRESHOLD == 0
+
+def _read_feedback_since(start: int):
+    """Return the (text, category) feedback records after the first `start` ones"""
+    with open(FEEDBACK_PATH, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        return [(row[0], row[1]) for row in islice(reader, start, None)]
+
+def update_model_incrementally(text: str, category: str, model=None):
+    """Fold a single feedback sample into the model (the current one by default) with partial_fit"""
+    if model is None:
+        model = get_nb_model()
+    nb = model.named_steps['nb']
+    if category not in nb.classes_:
+        # partial_fit cannot add new classes; the next full retrain picks them up
+        return False
+    # The fitted hasher/tfidf steps are reused as-is, only the NB counts change
+    X_new = model[:-1].transform([text])
+    nb.partial_fit(X_new, [category], classes=nb.classes_)
+    clear_prediction_cache()
+    return True
 
-def should_retrain():
-    """Check if model should be retrained based on feedback count"""
-    return get_feedback_count() >= RETRAIN_THRESHOLD
+def record_feedback(text: str, category: str):
+    """
+    Save feedback and fold it into the model. The updated model is written to
+    MODEL_PATH every INCREMENTAL_SAVE_EVERY updates, so at most that many
+    updates are lost on restart (the feedback itself is always in the CSV)
+    """
+    global _unsaved_updates
+    with _model_update_lock:
+        save_feedback(text, category)
+        updated = update_model_incrementally(text, category)
+        if updated:
+            _unsaved_updates += 1
+            # While a retrain runs, its worker owns MODEL_PATH
+            if _unsaved_updates >= INCREMENTAL_SAVE_EVERY and not _retrain_running:
+                save_nb_model(get_nb_model())
+                _unsaved_updates = 0
+        return updated
+
+def _retrain_to_disk():
+    """
+    Retrain in the worker process; the model is handed back through MODEL_PATH.
+    Returns how many feedback rows it was trained on
+    """
+    feedback_rows = _count_feedback_rows()
+    print(f"Retraining model with {feedback_rows} feedback samples...")
+    train_nb_model(feedback_rows=feedback_rows)
+    return feedback_rows
+
+def _swap_retrained_model(future):
+    """Load the freshly trained model once the worker process finishes"""
+    global nb_model, _retrain_status, _unsaved_updates, _retrain_running
+    try:
+        trained_rows = future.result()
+        new_model = load_nb_model()
+    except InsufficientTrainingDataError as ve:
+        _retrain_status = f"Cannot retrain yet: {ve}"
+        print(_retrain_status)
+        _retrain_running = False
+        return
+    except Exception as te:
+        _retrain_status = f"Training failed: {te}"
+        print(f"Training error: {te}")
+        _retrain_running = False
+        return
+    with _model_update_lock:
+        # Feedback saved while the worker was training only reached the old model
+        missed = _read_feedback_since(trained_rows)
+        for text, category in missed:
+            update_model_incrementally(text, category, model=new_model)
+        if missed:
+            save_nb_model(new_model)
+        nb_model = new_model
+        _unsaved_updates = 0
+        _retrain_running = False
+        clear_prediction_cache()
+    _retrain_status = "Model retrained successfully"
+    print(f"Model retrained successfully! Replayed {len(missed)} newer feedback samples.")
+
+def start_retrain():
+    """Submit a full retrain unless one is already running"""
+    global _retrain_future, _retrain_running
+    if _retrain_running:
+        return False
+    _retrain_running = True
+    _retrain_future = _retrain_executor.submit(_retrain_to_disk)
+    _retrain_future.add_done_callback(_swap_retrained_model)
+    return True
 
 @app_nb.post("/feedback")
 async def feedback(input: FeedbackInput):
     """
-    Store feedback and retrain model when threshold is reached
+    Store feedback, update the model incrementally and schedule a full
+    retrain in the background when the threshold is reached
     """
-    global nb_model
     try:
-        save_feedback(input.text, input.category)
-        
-        if should_retrain():
-            try:
-                print(f"Retraining model with {get_feedback_count()} feedback samples...")
-                nb_model = train_nb_model()
-                print("Model retrained successfully!")
-                return {"message": f"Model retrained with feedback data. Total feedback: {get_feedback_count()}", "category": input.category}
-            except ValueError as ve:
-                return {"message": f"Cannot retrain yet: {str(ve)}", "category": input.category, "feedback_count": get_feedback_count()}
-            except Exception as te:
-                print(f"Training error: {te}")
-                return {"message": f"Training failed: {str(te)}", "category": input.category, "feedback_count": get_feedback_count()}
+        # The first use may load or even train the model, and saves write the
+        # model file; keep both off the event loop
+        updated = await asyncio.to_thread(record_feedback, input.text, input.category)
+        status = "Feedback saved and model updated." if updated else "Feedback saved."
+        feedback_count = get_feedback_count()
+        if _retrain_status is not None:
+            status += f" Last retrain: {_retrain_status}."
+
+        if should_retrain(feedback_count):
+            if start_retrain():
+                status += f" Full retraining started with {feedback_count} feedback samples."
+            else:
+                status += " Full retraining already in progress."
+            return {"message": status, "category": input.category, "feedback_count": feedback_count, "retrain_status": _retrain_status}
         else:
-            remaining = RETRAIN_THRESHOLD - get_feedback_count()
-            return {"message": f"Feedback saved. {remaining} more needed for retraining.", "category": input.category, "feedback_count": get_feedback_count()}
+            remaining = RETRAIN_THRESHOLD - feedback_count % RETRAIN_THRESHOLD
+            return {"message": f"{status} {remaining} more needed for retraining.", "category": input.category, "feedback_count": feedback_count, "retrain_status": _retrain_status}
     except Exception as e:
         print(f"Feedback processing error: {e}")
         raise HTTPException(status_code=500, detail=f"Feedback error: {str(e)}")
@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import Future
+
+import numpy as np
+
+import main
+
+
+NOTES = [
+    ("bought fresh vegetables fruits rice lentils and cooking oil from the local market", "Food"),
+    ("lunch with friends at the restaurant near office including momo chowmein and tea", "Food"),
+    ("monthly grocery shopping for milk bread eggs butter sugar and snacks at supermarket", "Food"),
+    ("paid bus fare and taxi ride from home to office and back in the evening", "Transportation"),
+    ("filled motorbike petrol tank and paid parking fee at the city center mall", "Transportation"),
+    ("booked flight ticket from kathmandu to pokhara for the weekend family trip", "Transportation"),
+]
+
+
+def test_pipeline_fits_and_predicts_long_notes():
+    texts = [text for text, _ in NOTES]
+    labels = [label for _, label in NOTES]
+    for analyzer in (main._UNIGRAM_ANALYZER, main._BIGRAM_ANALYZER):
+        pipeline = main.build_nb_pipeline().set_params(hash__analyzer=analyzer)
+        pipeline.fit(texts, labels)
+        proba = pipeline.predict_proba(texts)
+        assert proba.shape == (len(texts), 2)
+        assert list(pipeline.predict(texts)) == labels
+
+
+def _failed_retrain(exc):
+    future = Future()
+    future.set_exception(exc)
+    return future
+
+
+def test_retrain_failures_are_not_reported_as_missing_data(monkeypatch):
+    monkeypatch.setattr(main, "_retrain_status", None)
+
+    main._swap_retrained_model(_failed_retrain(main.InsufficientTrainingDataError("only 2 samples")))
+    assert main._retrain_status == "Cannot retrain yet: only 2 samples"
+
+    main._swap_retrained_model(_failed_retrain(ValueError("All the 6 fits failed")))
+    assert main._retrain_status == "Training failed: All the 6 fits failed"
+
+
+def test_feedback_count_survives_multiline_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "FEEDBACK_PATH", str(tmp_path / "feedback.csv"))
+    monkeypatch.setattr(main, "_feedback_count", 0)
+
+    main.save_feedback("bus fare", "Transportation")
+    main.save_feedback("groceries\nand vegetables", "Food")
+
+    assert main.get_feedback_count() == 2
+    assert main._count_feedback_rows() == 2
+
+
+def test_train_on_small_feedback_only_corpus(tmp_path, monkeypatch):
+    feedback = tmp_path / "feedback_data.csv"
+    feedback.write_text("text,category\n" + "".join(f"{text},{label}\n" for text, label in NOTES * 2))
+    monkeypatch.chdir(tmp_path)
+
+    model = main.train_nb_model()
+
+    assert set(model.classes_) == {"Food", "Transportation"}
+    assert (tmp_path / main.MODEL_PATH).exists()
+
+
+def test_incremental_updates_are_saved_periodically(tmp_path, monkeypatch):
+    texts = [text for text, _ in NOTES]
+    labels = [label for _, label in NOTES]
+    monkeypatch.setattr(main, "nb_model", main.build_nb_pipeline().fit(texts, labels))
+    monkeypatch.setattr(main, "MODEL_PATH", str(tmp_path / "nb_model.pkl"))
+    monkeypatch.setattr(main, "FEEDBACK_PATH", str(tmp_path / "feedback.csv"))
+    monkeypatch.setattr(main, "_unsaved_updates", 0)
+    monkeypatch.setattr(main, "_feedback_count", 0)
+
+    for _ in range(main.INCREMENTAL_SAVE_EVERY - 1):
+        assert main.record_feedback("chiya at the canteen", "Food")
+    assert not (tmp_path / "nb_model.pkl").exists()
+
+    assert main.record_feedback("chiya at the canteen", "Food")
+    saved = main.load_nb_model().named_steps["nb"]
+    assert (saved.feature_count_ == main.nb_model.named_steps["nb"].feature_count_).all()
+
+
+def test_feedback_saved_during_retrain_is_replayed(tmp_path, monkeypatch):
+    texts = [text for text, _ in NOTES]
+    labels = [label for _, label in NOTES]
+    monkeypatch.setattr(main, "MODEL_PATH", str(tmp_path / "nb_model.pkl"))
+    monkeypatch.setattr(main, "FEEDBACK_PATH", str(tmp_path / "feedback.csv"))
+    monkeypatch.setattr(main, "nb_model", main.build_nb_pipeline().fit(texts, labels))
+    monkeypatch.setattr(main, "_feedback_count", 0)
+    monkeypatch.setattr(main, "_retrain_running", True)
+    monkeypatch.setattr(main, "_retrain_status", None)
+    monkeypatch.setattr(main, "_unsaved_updates", 0)
+    for text, label in NOTES:
+        main.save_feedback(text, label)
+    # The worker trained on the six rows above; two more arrive before the swap
+    main.save_nb_model(main.build_nb_pipeline().fit(texts, labels))
+    main.save_feedback("chiya and samosa at the canteen", "Food")
+    main.save_feedback("microbus fare to college", "Transportation")
+    trained = Future()
+    trained.set_result(len(NOTES))
+
+    main._swap_retrained_model(trained)
+
+    expected = main.build_nb_pipeline().fit(texts, labels)
+    main.update_model_incrementally("chiya and samosa at the canteen", "Food", model=expected)
+    main.update_model_incrementally("microbus fare to college", "Transportation", model=expected)
+    swapped = main.nb_model.named_steps["nb"].feature_count_
+    assert np.allclose(swapped, expected.named_steps["nb"].feature_count_)
+    assert np.allclose(main.load_nb_model().named_steps["nb"].feature_count_, swapped)
+    assert not main._retrain_running
+
+
+def test_predict_batch_matches_predict_proba(monkeypatch):
+    texts = [text for text, _ in NOTES]
+    labels = [label for _, label in NOTES]
+    model = main.build_nb_pipeline().fit(texts, labels)
+    monkeypatch.setattr(main, "nb_model", model)
+    queries = ["chiya and momo at the canteen", "taxi fare to the airport", texts[0]]
+
+    results = main._predict_batch(queries)
+
+    proba = model.predict_proba(queries)
+    assert [category for category, _ in results] == list(model.classes_[proba.argmax(axis=1)])
+    assert np.allclose([confidence for _, confidence in results], proba.max(axis=1))
+
+
+def test_cache_fill_from_older_generation_is_dropped():
+    main.clear_prediction_cache()
+    generation = main._cache_generation
+    main._cache_prediction("bus fare", ("Transportation", 0.9), generation)
+    assert main._get_cached_prediction("bus fare") == ("Transportation", 0.9)
+
+    main.clear_prediction_cache()
+    assert main._get_cached_prediction("bus fare") is None
+    main._cache_prediction("bus fare", ("Food", 0.5), generation)
+    assert main._get_cached_prediction("bus fare") is None
+
+
+def test_batch_failure_reaches_every_waiting_request(monkeypatch):
+    def failing_batch(texts):
+        raise RuntimeError("model exploded")
+    monkeypatch.setattr(main, "_predict_batch", failing_batch)
+
+    async def run():
+        monkeypatch.setattr(main, "_predict_queue", asyncio.Queue())
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in range(3)]
+        for i, future in enumerate(futures):
+            await main._predict_queue.put((f"note {i}", future))
+        batcher = asyncio.create_task(main._predict_batcher())
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        batcher.cancel()
+        return results
+
+    results = asyncio.run(run())
+    assert len(results) == 3
+    assert all(isinstance(r, RuntimeError) and str(r) == "model exploded" for r in results)